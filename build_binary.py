@@ -1,20 +1,139 @@
 #!/usr/bin/env python3
 """Build script to create executable binary using PyInstaller."""
 
+import argparse
+import collections
+import hashlib
+import importlib.util
 import subprocess
 import sys
 import os
 import shutil
 import platform
+import threading
+
+BUILD_TIMEOUT = 1200
+# spaCy language packages to bundle; the CLI only loads English pipelines.
+LANGUAGES = {"en"}
+
+# Modules that get pulled in transitively but are never used by the CLI. torch
+# itself must stay: the en_core_web_trf pipeline runs on curated-transformers.
+EXCLUDED_MODULES = [
+    "torchvision",
+    "torchaudio",
+    "tensorflow",
+    "tkinter",
+    "matplotlib",
+    "IPython",
+    "jupyter",
+    "notebook",
+    "PyQt5",
+    "PySide2",
+    "pandas.tests",
+    "numpy.tests",
+    "sklearn.tests",
+]
+
+# Libraries UPX is known to corrupt on Windows.
+UPX_EXCLUDES = [
+    "vcruntime140.dll",
+    "python3*.dll",
+    "libcrypto-*.dll",
+]
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Build the pii-cli binary with PyInstaller")
+
+    parser.add_argument(
+        "--onefile",
+        action="store_true",
+        help="Build a single self-extracting executable instead of a directory bundle "
+             "(slower startup: the whole bundle is unpacked on every launch)"
+    )
+    parser.add_argument(
+        "--force-clean",
+        action="store_true",
+        help="Discard PyInstaller's cached work directory and analysis before building"
+    )
+    parser.add_argument(
+        "--optimize",
+        type=int,
+        choices=[0, 1, 2],
+        default=1,
+        help="Bytecode optimization level for bundled modules: 1 strips asserts, "
+             "2 also strips docstrings (default: 1)"
+    )
+
+    return parser
+
+
+def unused_spacy_languages():
+    """List spaCy language subpackages not in LANGUAGES, without importing spaCy."""
+    spec = importlib.util.find_spec("spacy")
+    if spec is None or not spec.submodule_search_locations:
+        return []
+
+    lang_dir = os.path.join(spec.submodule_search_locations[0], "lang")
+    return sorted(
+        f"spacy.lang.{name}"
+        for name in os.listdir(lang_dir)
+        if name not in LANGUAGES and os.path.isfile(os.path.join(lang_dir, name, "__init__.py"))
+    )
+
+
+def work_cache_key():
+    """Key PyInstaller's work directory on the locked dependencies, platform and Python version."""
+    digest = hashlib.sha256()
+    with open("uv.lock", "rb") as f:
+        digest.update(f.read())
+    # Not platform.platform(): it includes the kernel release, which changes with runner images.
+    digest.update(f"{sys.platform}-{platform.machine()}-{platform.python_version()}".encode())
+    return digest.hexdigest()[:16]
+
+
+def remove_stale_work_dirs(workpath):
+    """Delete work directories left by other cache keys so the build cache doesn't grow."""
+    if not os.path.isdir("build"):
+        return
+    for name in os.listdir("build"):
+        path = os.path.join("build", name)
+        if name.startswith("pyi-work-") and path != workpath:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def find_upx_dir():
+    """Return the directory containing the upx binary, honouring UPX_DIR."""
+    upx_dir = os.getenv("UPX_DIR")
+    if upx_dir:
+        return upx_dir
+
+    upx_path = shutil.which("upx")
+    if upx_path:
+        return os.path.dirname(upx_path)
+    return None
+
+
+def report_largest_files(path, count=20):
+    """Print the largest files under path so bundle size regressions are visible."""
+    sizes = []
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            sizes.append((os.path.getsize(file_path), file_path))
+
+    print(f"Largest files in {path}:")
+    for size, file_path in sorted(sizes, reverse=True)[:count]:
+        print(f"  {size / (1024 * 1024):8.1f} MB  {file_path}")
+
 
 def main():
     """Build the CLI tool into a standalone executable."""
+    args = create_parser().parse_args()
+
     print("Building executable binary...")
-    
+
     if os.path.exists("dist"):
         shutil.rmtree("dist")
-    if os.path.exists("build"):
-        shutil.rmtree("build")
 
     system = platform.system().lower()
     arch = platform.machine().lower()
@@ -24,46 +143,122 @@ def main():
         arch = 'arm64'
 
     binary_name = f"pii-cli-{system}-{arch}"
+    executable_name = binary_name
     if system == "windows":
-        binary_name += ".exe"
-    
+        executable_name += ".exe"
+
+    workpath = os.path.join("build", f"pyi-work-{work_cache_key()}")
+    remove_stale_work_dirs(workpath)
+
+    if args.onefile:
+        executable_path = f"dist/{executable_name}"
+    else:
+        executable_path = f"dist/{binary_name}/{executable_name}"
+
     cmd = [
         "pyinstaller",
-        "--onefile",           
-        "--name", binary_name, 
-        "--clean",           
+        "--onefile" if args.onefile else "--onedir",
+        "--name", binary_name,
+        "--workpath", workpath,
+        "--specpath", workpath,
+        "--optimize", str(args.optimize),
         "--noconfirm",
         "--collect-all", "curated_transformers",
         "--collect-all", "spacy_curated_transformers",
-        "--hidden-import", "spacy_curated_transformers",
-        "--hidden-import", "spacy_curated_transformers.language",
-        "--hidden-import", "spacy_curated_transformers.pipeline.curated_transformer",
-        "--hidden-import", "spacy_curated_transformers.tokenization",
         "--hidden-import", "regex",
-        "pii_cli.py"
     ]
-    
+    if args.force_clean:
+        cmd.append("--clean")
+    if system == "linux":
+        # Strips binaries as they are collected, before the bundle is assembled; stripped copies are kept in PyInstaller's binary cache.
+        cmd.append("--strip")
+    for module in EXCLUDED_MODULES + unused_spacy_languages():
+        cmd.extend(["--exclude-module", module])
+
+    upx_dir = None
+    if system == "windows":
+        upx_dir = find_upx_dir()
+        if upx_dir:
+            cmd.extend(["--upx-dir", upx_dir])
+            for pattern in UPX_EXCLUDES:
+                cmd.extend(["--upx-exclude", pattern])
+        else:
+            print("UPX not found (set UPX_DIR or add upx to PATH); binaries will not be compressed")
+    else:
+        print("PyInstaller only applies UPX on Windows; binaries will not be compressed")
+    if not args.onefile:
+        cmd.extend(["--contents-directory", "_internal", "--noarchive"])
+    cmd.append(os.path.abspath("pii_cli.py"))
+
     try:
         print("Starting PyInstaller build (this may take several minutes)...")
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=1200)
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1
+        )
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(BUILD_TIMEOUT, kill)
+        timer.start()
+        log_tail = collections.deque(maxlen=50)
+        upx_used = False
+        try:
+            for line in process.stdout:
+                sys.stdout.write(line)
+                log_tail.append(line)
+                upx_used = upx_used or "UPX is available and will be used" in line
+            returncode = process.wait()
+        finally:
+            timer.cancel()
+            # Don't leave PyInstaller running if reading its output failed.
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, BUILD_TIMEOUT)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, output="".join(log_tail))
         print("Build successful!")
-        print(f"Executable created: dist/{binary_name}")
-        
+
+        if upx_dir and not upx_used:
+            print(f"Warning: PyInstaller did not use UPX from {upx_dir}")
+        print(f"Executable created: {executable_path}")
+
         if os.name != 'nt':
-            executable_path = f"dist/{binary_name}"
             if os.path.exists(executable_path):
                 os.chmod(executable_path, 0o755)
                 print(f"Made {executable_path} executable")
-        
+
+        report_largest_files(os.path.join(workpath, binary_name) if args.onefile else f"dist/{binary_name}")
+
+        if not args.onefile:
+            archive_path = shutil.make_archive(
+                f"dist/{binary_name}",
+                "zip" if system == "windows" else "gztar",
+                root_dir="dist",
+                base_dir=binary_name
+            )
+            print(f"Archive created: {archive_path}")
+
         return True
-        
+
     except subprocess.TimeoutExpired:
-        print("Build timed out after 5 minutes. This may indicate a hanging process.")
+        print(f"Build timed out after {BUILD_TIMEOUT // 60} minutes. This may indicate a hanging process.")
         print("Try running the build command manually to see the full output.")
         return False
     except subprocess.CalledProcessError as e:
         print(f"Build failed: {e}")
-        print(f"Error output: {e.stderr}")
+        print(f"Last lines of output:\n{e.output}")
         return False
     except FileNotFoundError:
         print("Error: PyInstaller not found. Please install it with: pip install pyinstaller")
@@ -1,10 +1,18 @@
 import argparse
-from spacy_detector import SpacyNERPIIDetector
+import collections
+import os
+import select
+import sys
+
+BATCH_TIMEOUT = 0.05
+READ_SIZE = 65536
 
 def create_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="PII Detection and Anonymization CLI",
-        epilog="Example: echo 'Contact John at john@email.com' | pii-cli --local-model-path path_to_spacy_model"
+        epilog="Example: echo 'Contact John at john@email.com' | pii-cli --local-model-path path_to_spacy_model. "
+               "Set PII_USE_GPU=1 to run the spaCy pipeline on a CUDA GPU when one is available, "
+               "or PII_USE_GPU=require to fail instead of falling back to CPU."
     )
     
     parser.add_argument(
@@ -16,6 +24,58 @@ def create_parser() -> argparse.ArgumentParser:
     return parser
 
 
+def stdin_ready(fd: int, timeout: float) -> bool:
+    if os.name == "nt":
+        return False
+    readable, _, _ = select.select([fd], [], [], timeout)
+    return bool(readable)
+
+
+class StdinReader:
+    """Splits lines off the raw stdin descriptor.
+
+    Lines are buffered here rather than in sys.stdin.buffer, so select() never
+    misses input that has already been read from the pipe.
+    """
+
+    def __init__(self):
+        self.fd = sys.stdin.fileno()
+        self.lines = collections.deque()
+        self.partial = b""
+        self.eof = False
+
+    def fill(self):
+        chunk = os.read(self.fd, READ_SIZE)
+        if not chunk:
+            self.eof = True
+            if self.partial:
+                self.lines.append(self.partial)
+                self.partial = b""
+            return
+        *complete, self.partial = (self.partial + chunk).split(b"\n")
+        self.lines.extend(complete)
+
+    def read_batch(self, batch_size: int) -> tuple[list[str], bool]:
+        """Read up to batch_size lines, flushing early once input stalls for BATCH_TIMEOUT.
+
+        Returns the lines read and whether input ended (blank line or EOF).
+        """
+        lines = []
+        while len(lines) < batch_size:
+            if not self.lines:
+                if self.eof:
+                    return lines, True
+                if lines and not stdin_ready(self.fd, BATCH_TIMEOUT):
+                    break
+                self.fill()
+                continue
+            line = self.lines.popleft().decode("utf-8").strip()
+            if not line:
+                return lines, True
+            lines.append(line)
+        return lines, False
+
+
 def main():
     parser = create_parser()
     args = parser.parse_args()
@@ -23,14 +83,19 @@ def main():
     if args.local_model_path is None:
         raise ValueError("Local model path is required. Use --local-model-path to specify the path to your spaCy model.")
 
+    # Imported here so --help and argument errors don't pay for loading spaCy and torch.
+    from spacy_detector import SpacyNERPIIDetector
+
     detector = SpacyNERPIIDetector(model_path=args.local_model_path)
+    reader = StdinReader()
     try:
-        while True:
-            line = input().strip()
-            if not line:
-                break
-            result = detector.detect_pii_combined(line)
-            print(result)
+        done = False
+        while not done:
+            lines, done = reader.read_batch(detector.batch_size)
+            results = detector.detect_pii_batch(lines)
+            if results:
+                sys.stdout.buffer.write("".join(f"{result}\n" for result in results).encode("utf-8"))
+                sys.stdout.buffer.flush()
     except KeyboardInterrupt:
         return 130
     except FileNotFoundError:
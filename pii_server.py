@@ -1,65 +1,178 @@
 import json
 import os
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from spacy_detector import SpacyNERPIIDetector
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from hashlib import blake2b
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    encode_json = orjson.dumps
+    decode_json = orjson.loads
+else:
+    _encode_json = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+    def encode_json(obj):
+        return _encode_json(obj).encode('utf-8')
+
+    decode_json = json.loads
+
+# Concurrent requests are collected for up to BATCH_WAIT seconds (or until the
+# detector's nlp.pipe batch size is reached) and run through nlp.pipe together.
+BATCH_WAIT = 0.01
+
+RESPONSE_CACHE_SIZE = 4096
 
 class Model:
     def __init__(self):
-        self.is_loaded = False
+        self.detector = None
+        self.load_error = None
+        self.load_lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.responses = OrderedDict()
+        self.responses_lock = threading.Lock()
         self.model_path = os.getenv("SPACY_MODEL_PATH", "extracted_model/en_core_web_trf/en_core_web_trf-3.8.0")
 
     def load(self):
-        print(f"Loading {self.model_path}...")
-        self.is_loaded = True
-        detector = SpacyNERPIIDetector(model_path=self.model_path)
-        self.detector = detector
-        print(f"{self.model_path} loaded successfully!")
+        """Load the detector once; a failed load is remembered and reported on later calls."""
+        if self.detector is not None:
+            return
+        with self.load_lock:
+            if self.detector is not None:
+                return
+            if self.load_error is not None:
+                # A fresh exception each time: re-raising the stored one would keep
+                # extending its traceback, and every handler frame with it.
+                raise RuntimeError(self.load_error)
+            print(f"Loading {self.model_path}...")
+            try:
+                from spacy_detector import SpacyNERPIIDetector
+                self.detector = SpacyNERPIIDetector(model_path=self.model_path)
+            except Exception as e:
+                self.load_error = str(e)
+                print(f"Failed to load {self.model_path}: {e}")
+                raise
+            threading.Thread(target=self.run_batches, daemon=True).start()
+            print(f"{self.model_path} loaded successfully!")
 
     def infer(self, input_text):
-        if not self.is_loaded:
-            raise RuntimeError("Model not loaded")
-        print(f"Processing inference: {input_text}")
-        result = self.detector.detect_pii_combined(input_text)
-        return result
+        self.load()
+        future = Future()
+        self.requests.put((input_text, future))
+        return future.result()
+
+    def infer_response(self, input_text):
+        """Return the encoded /infer response body, reusing it for repeated inputs."""
+        key = blake2b(input_text.encode('utf-8'), digest_size=16).digest()
+        with self.responses_lock:
+            body = self.responses.get(key)
+            if body is not None:
+                self.responses.move_to_end(key)
+                return body
+
+        body = encode_json({"output": self.infer(input_text)})
+        with self.responses_lock:
+            self.responses[key] = body
+            if len(self.responses) > RESPONSE_CACHE_SIZE:
+                self.responses.popitem(last=False)
+        return body
+
+    def run_batches(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + BATCH_WAIT
+            while len(batch) < self.detector.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                results = self.detector.detect_pii_batch([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
 
 model = Model()
 
 class ModelHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    INVALID_JSON_BODY = encode_json({"error": "Invalid JSON"})
+    READY_BODY = encode_json({"status": "ready"})
+
     def do_POST(self):
-        if self.path == '/infer':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
+        # Always drain the body so the next request on a keep-alive connection starts clean.
+        post_data = self.read_body(int(self.headers.get('Content-Length', 0)))
 
+        if self.path == '/infer':
+            if not self.ensure_model():
+                return
             try:
-                data = json.loads(post_data.decode('utf-8'))
+                data = decode_json(post_data)
                 input_text = data.get('input', '')
 
-                response = model.infer(input_text)
-
-                print(f"Response : {response}\n")
-
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"output": response}).encode('utf-8'))
+                self.send_json(200, model.infer_response(input_text))
 
             except json.JSONDecodeError:
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": "Invalid JSON"}).encode('utf-8'))
+                self.send_json(400, self.INVALID_JSON_BODY)
+        elif self.path == '/warmup':
+            if not self.ensure_model():
+                return
+            self.send_json(200, self.READY_BODY)
         else:
             self.send_response(404)
+            self.send_header('Content-Length', '0')
             self.end_headers()
 
+    def ensure_model(self):
+        """Load the model if needed, answering 503 when it cannot be loaded."""
+        try:
+            model.load()
+        except Exception as e:
+            self.send_json(503, encode_json({"error": f"Model failed to load: {e}"}))
+            return False
+        return True
+
+    def read_body(self, content_length):
+        body = bytearray(content_length)
+        view = memoryview(body)
+        received = 0
+        while received < content_length:
+            n = self.rfile.readinto(view[received:])
+            if not n:
+                del body[received:]
+                break
+            received += n
+        return body
+
+    def send_json(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def log_message(self, format, *args):
         print(f"[{self.address_string()}] {format % args}")
 
 def main():
     print("Starting model server...")
-    model.load()
 
-    server = HTTPServer(('localhost', 0), ModelHandler)
+    server = ThreadingHTTPServer(('localhost', 0), ModelHandler)
     port = server.server_address[1]
     print(f"SERVER_PORT:{port}")
 
@@ -1,17 +1,62 @@
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from hashlib import blake2b
+from itertools import chain
 from pathlib import Path
 import spacy
 import re
-from typing import Dict, List
-from spacy.matcher import Matcher
+from typing import Dict, List, Optional
+from spacy.lang.lex_attrs import like_url
+from spacy.language import Language
+from spacy.matcher import Matcher, PhraseMatcher
+from spacy.tokens import Doc
+
+# Internal entity record; converted to a dict only when returned to callers.
+Entity = namedtuple('Entity', 'entity_type spacy_label text start end confidence')
+
+@lru_cache(maxsize=4)
+def _load_nlp(model_path: str, using_gpu: bool) -> Language:
+    """Load a pipeline once per process; detectors on the same model share it."""
+    overrides = {}
+    if using_gpu and "transformer" in spacy.util.load_config(Path(model_path) / "config.cfg")["nlp"]["pipeline"]:
+        # fp16 autocast for the transformer forward pass; thinc only supports it on CUDA.
+        overrides["components.transformer.model.mixed_precision"] = True
+    
+    # Only the NER head and tokenizer attributes (SHAPE, LIKE_EMAIL, LIKE_URL) are used.
+    return spacy.load(
+        Path(model_path),
+        exclude=["tagger", "parser", "lemmatizer", "attribute_ruler"],
+        config=overrides
+    )
 
 class SpacyNERPIIDetector:
     def __init__(self, model_path: str):
         self.model_path = model_path
         
-        self.nlp = spacy.load(Path(model_path))
+        gpu_mode = os.getenv("PII_USE_GPU")
+        if gpu_mode == "require":
+            self.using_gpu = spacy.require_gpu()
+        else:
+            self.using_gpu = gpu_mode == "1" and spacy.prefer_gpu()
+        
+        self.nlp = _load_nlp(str(Path(model_path).resolve()), self.using_gpu)
         self.matcher = Matcher(self.nlp.vocab)
+        self.phrase_matcher = PhraseMatcher(self.nlp.vocab, attr="SHAPE")
         self._setup_custom_patterns()
         
+        # Larger batches on GPU amortise kernel launch overhead.
+        self.batch_size = int(os.getenv("PII_BATCH_SIZE", "256" if self.using_gpu else "64"))
+        # Worker processes each hold a copy of the model; only worth it for large CPU batches.
+        self.n_process = int(os.getenv("PII_N_PROCESS", "1"))
+        
+        self._cache = OrderedDict()
+        self._cache_max = 2048
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        # Smaller batches scan inline: the thread handoff costs about what the overlap saves.
+        self._pool_min_batch = 8
+        
         self.pii_entity_mapping = {
             'PERSON': 'person_name',
             'ORG': 'organization',
@@ -24,14 +69,22 @@ class SpacyNERPIIDetector:
             'ORDINAL': 'number'
         }
         
+        # Where two patterns match at the same offset the longer match wins, then
+        # the one listed first.
         self.custom_patterns = {
+            'url': r'(?:(?:https?://|www\.)(?:[-\w.])+|\b(?:[A-Za-z0-9-]+\.)+[A-Za-z]{2,}\b)(?:[:\d]+)?(?:/(?:[\w/_.])*(?:\?(?:[\w&=%.])*)?(?:#(?:[\w.])*)?)?',
             'email': r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
-            'phone': r'(\+?1[-.\s]?)?\(?([0-9]{3})\)?[-.\s]?([0-9]{3})[-.\s]?([0-9]{4})',
             'ssn': r'\b\d{3}-\d{2}-\d{4}\b',
             'credit_card': r'\b(?:\d{4}[-\s]?){3}\d{4}\b',
             'ip_address': r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b',
-            'url': r'https?://(?:[-\w.])+(?:[:\d]+)?(?:/(?:[\w/_.])*(?:\?(?:[\w&=%.])*)?(?:#(?:[\w.])*)?)?'
+            'phone': r'(\+?1[-.\s]?)?\(?([0-9]{3})\)?[-.\s]?([0-9]{3})[-.\s]?([0-9]{4})'
         }
+        self.fused_pattern = re.compile("|".join(f"(?P<{pii_type}>{pattern})" for pii_type, pattern in self.custom_patterns.items()))
+        self._regex_labels = {pii_type: pii_type.upper() for pii_type in self.custom_patterns}
+        # Alternation stops at the first branch that matches, so each type keeps the
+        # patterns after it to check for a longer match at the same offset.
+        compiled = [(pii_type, re.compile(pattern)) for pii_type, pattern in self.custom_patterns.items()]
+        self._later_patterns = {pii_type: compiled[i + 1:] for i, (pii_type, _) in enumerate(compiled)}
     
     def _setup_custom_patterns(self):
         email_pattern = [
@@ -39,12 +92,10 @@ class SpacyNERPIIDetector:
         ]
         self.matcher.add("EMAIL", [email_pattern])
         
-        phone_pattern = [
-            {"SHAPE": "ddd-ddd-dddd"},
-            {"SHAPE": "(ddd) ddd-dddd"},
-            {"TEXT": {"REGEX": r"\(\d{3}\)\s?\d{3}-\d{4}"}}
-        ]
-        self.matcher.add("PHONE", [phone_pattern])
+        # Matched on token shape, so each example covers every number written the same way.
+        # "(555)123-4567" needs its own entry: the tokenizer keeps "555)123" as one token.
+        phone_examples = ["555-123-4567", "(555) 123-4567", "(555)123-4567"]
+        self.phrase_matcher.add("PHONE", [self.nlp.make_doc(example) for example in phone_examples])
         
         url_pattern = [
             {"LIKE_URL": True}
@@ -52,74 +103,130 @@ class SpacyNERPIIDetector:
         self.matcher.add("URL", [url_pattern])
     
     def detect_pii_ner(self, text: str) -> List[Dict]:
-        doc = self.nlp(text)
-        pii_entities = []
-        
-        for ent in doc.ents:
-            if ent.label_ in self.pii_entity_mapping:
-                pii_entities.append({
-                    'entity_type': self.pii_entity_mapping[ent.label_],
-                    'spacy_label': ent.label_,
-                    'text': ent.text,
-                    'start': ent.start_char,
-                    'end': ent.end_char,
-                    'confidence': 1.0
-                })
-        
-        return pii_entities
+        return [entity._asdict() for entity in self._ner_from_doc(self.nlp(text))]
+    
+    def _ner_from_doc(self, doc: Doc) -> List[Entity]:
+        mapping = self.pii_entity_mapping
+        return [
+            Entity(mapping[ent.label_], ent.label_, ent.text, ent.start_char, ent.end_char, 1.0)
+            for ent in doc.ents
+            if ent.label_ in mapping
+        ]
     
     def detect_pii_matcher(self, text: str) -> List[Dict]:
-        doc = self.nlp(text)
-        matches = self.matcher(doc)
-        pii_entities = []
-        
-        for match_id, start, end in matches:
-            label = self.nlp.vocab.strings[match_id]
-            span = doc[start:end]
-            pii_entities.append({
-                'entity_type': label.lower(),
-                'spacy_label': label,
-                'text': span.text,
-                'start': span.start_char,
-                'end': span.end_char,
-                'confidence': 1.0
-            })
-        
-        return pii_entities
+        # The patterns only read lexical attributes, so tokenizing is enough.
+        return [entity._asdict() for entity in self._matcher_from_doc(self.nlp.make_doc(text))]
+    
+    def _matcher_from_doc(self, doc: Doc) -> List[Entity]:
+        return [
+            Entity(span.label_.lower(), span.label_, span.text, span.start_char, span.end_char, 1.0)
+            for span in chain(self.matcher(doc, as_spans=True), self.phrase_matcher(doc, as_spans=True))
+        ]
     
     def detect_pii_regex(self, text: str) -> List[Dict]:
-        pii_entities = []
-        
-        for pii_type, pattern in self.custom_patterns.items():
-            for match in re.finditer(pattern, text):
-                pii_entities.append({
-                    'entity_type': pii_type,
-                    'spacy_label': pii_type.upper(),
-                    'text': match.group(),
-                    'start': match.start(),
-                    'end': match.end(),
-                    'confidence': 1.0
-                })
-        
-        return pii_entities
+        return [entity._asdict() for entity in self._regex_entities(text)]
+    
+    def _regex_entities(self, text: str) -> List[Entity]:
+        labels = self._regex_labels
+        entities = []
+        pos = 0
+        while (match := self.fused_pattern.search(text, pos)) is not None:
+            pii_type, start, end = match.lastgroup, match.start(), match.end()
+            if not self._plausible(pii_type, match.group()):
+                pii_type, end = None, start
+            for other_type, pattern in self._later_patterns[match.lastgroup]:
+                other = pattern.match(text, start)
+                if other is not None and other.end() > end and self._plausible(other_type, other.group()):
+                    pii_type, end = other_type, other.end()
+            if pii_type is None:
+                pos = start + 1
+                continue
+            entities.append(Entity(pii_type, labels[pii_type], text[start:end], start, end, 1.0))
+            pos = end
+        return entities
+    
+    def _plausible(self, pii_type: str, text: str) -> bool:
+        # A bare "word.word" is usually a missing space after a period, so scheme-less
+        # hosts must also pass spaCy's LIKE_URL check.
+        if pii_type != 'url' or text.startswith(('http://', 'https://', 'www.')):
+            return True
+        return like_url(re.split(r'[:/]', text, maxsplit=1)[0])
     
     def detect_pii_combined(self, text: str) -> List[Dict]:
-        all_entities = []
-        
-        all_entities.extend(self.detect_pii_ner(text))
-        
-        all_entities.extend(self.detect_pii_matcher(text))
-        
-        all_entities.extend(self.detect_pii_regex(text))
-        
-        unique_entities = []
-        seen = set()
-        
-        for entity in all_entities:
-            key = (entity['text'], entity['start'], entity['end'])
-            if key not in seen:
-                seen.add(key)
-                unique_entities.append(entity)
-        
-        return sorted(unique_entities, key=lambda x: x['start'])
+        return self.detect_pii_batch([text])[0]
+    
+    def detect_pii_batch(self, texts: List[str], batch_size: Optional[int] = None,
+                         n_process: Optional[int] = None) -> List[List[Dict]]:
+        results = [self._cache_get(text) for text in texts]
+        misses = [text for text, result in zip(texts, results) if result is None]
+        if not misses:
+            return [[entity._asdict() for entity in entities] for entities in results]
+        
+        batch_size = batch_size or self.batch_size
+        # nlp.pipe starts its worker processes on every call, so they only pay off
+        # when each one gets at least a full batch.
+        n_process = n_process or self.n_process
+        if len(misses) < n_process * batch_size:
+            n_process = 1
+        
+        # The regex scan is independent of the pipeline, so for larger batches it runs on
+        # the worker thread while nlp.pipe holds the main one (torch releases the GIL in its kernels).
+        # Never while forking worker processes: a busy thread at fork time can deadlock the children.
+        regex_future = None
+        if n_process == 1 and len(misses) >= self._pool_min_batch:
+            regex_future = self._pool.submit(lambda: [self._regex_entities(text) for text in misses])
+        docs = list(self.nlp.pipe(misses, batch_size=batch_size, n_process=n_process))
+        if regex_future is not None:
+            regex_results = regex_future.result()
+        else:
+            regex_results = [self._regex_entities(text) for text in misses]
+        computed = iter(zip(docs, regex_results))
+        
+        for i, text in enumerate(texts):
+            if results[i] is None:
+                doc, regex_entities = next(computed)
+                entities = self._resolve_overlaps(self._ner_from_doc(doc), regex_entities)
+                results[i] = self._cache_put(text, entities)
+        
+        return [[entity._asdict() for entity in entities] for entities in results]
+    
+    def clear_cache(self):
+        self._cache.clear()
+    
+    def _cache_get(self, text: str) -> Optional[List[Entity]]:
+        key = blake2b(text.encode('utf-8'), digest_size=16).digest()
+        entities = self._cache.get(key)
+        if entities is None:
+            return None
+        self._cache.move_to_end(key)
+        return entities
+    
+    def _cache_put(self, text: str, entities: List[Entity]) -> List[Entity]:
+        key = blake2b(text.encode('utf-8'), digest_size=16).digest()
+        self._cache[key] = entities
+        if len(self._cache) > self._cache_max:
+            self._cache.popitem(last=False)
+        return entities
+    
+    def _resolve_overlaps(self, *entity_groups: List[Entity]) -> List[Entity]:
+        """Keep non-overlapping entities, sweeping spans in start order.
+
+        At equal starts the longer span wins, then the earlier group
+        (groups are passed in priority order).
+        """
+        ranked = sorted(
+            ((entity.start, -entity.end, priority, entity)
+             for priority, entities in enumerate(entity_groups)
+             for entity in entities),
+            key=lambda r: r[:3]
+        )
+        
+        resolved = []
+        last_end = 0
+        for start, neg_end, _, entity in ranked:
+            if start >= last_end:
+                resolved.append(entity)
+                last_end = -neg_end
+        
+        return resolved
     